@@ -1,6 +1,5 @@
 # app.py
 import json
-from itertools import combinations
 from datetime import datetime
 
 import numpy as np
@@ -63,57 +62,14 @@ def build_name_to_field(cen_df: pd.DataFrame) -> dict:
     return name_to_field
 
 
-def collaboration_matrix_paper_level(df_papers: pd.DataFrame, cen_df: pd.DataFrame) -> pd.DataFrame:
-    name_to_field = build_name_to_field(cen_df)
-
-    # collect all areas seen in census
-    all_fields = sorted(
-        {
-            str(x).strip()
-            for x in cen_df["Area_desc"].dropna().unique()
-            if str(x).strip()
-        }
-    )
-    mat = pd.DataFrame(0, index=all_fields, columns=all_fields, dtype=int)
-
-    # Identify the column in df_papers that stores co-authors
-    candidate_cols = ["authors_full", "authors", "coauthors", "co_authors", "Authors", "Authors_full"]
-    authors_col = next((c for c in candidate_cols if c in df_papers.columns), None)
-    if authors_col is None:
-        raise ValueError(
-            f"Cannot find an authors column in chord_authors.csv. "
-            f"Tried: {candidate_cols}. Found columns: {list(df_papers.columns)}"
-        )
-
-    for _, row in df_papers.iterrows():
-        authors = parse_authors(row.get(authors_col, ""))
-
-        # map to areas (drop missing)
-        areas = []
-        for a in authors:
-            key = normalise_name(a)
-            field = name_to_field.get(key, "")
-            if field:
-                areas.append(field)
-
-        # unique areas in this paper
-        uniq = sorted(set(areas))
-        if len(uniq) < 2:
-            continue
-
-        # increment each unordered pair once per paper
-        for a, b in combinations(uniq, 2):
-            mat.loc[a, b] += 1
-            mat.loc[b, a] += 1
-
-    return mat
-
 def collaboration_matrix_paper_level(df_papers: pd.DataFrame, cen_df: pd.DataFrame) -> pd.DataFrame:
     name_to_field = build_name_to_field(cen_df)
 
     # collect all areas seen in census
     all_fields = sorted({str(x).strip() for x in cen_df["Area_desc"].dropna().unique() if str(x).strip()})
-    mat = pd.DataFrame(0, index=all_fields, columns=all_fields, dtype=int)
+    idx = {f: i for i, f in enumerate(all_fields)}
+    n = len(all_fields)
+    pair_keys: list[np.ndarray] = []
 
     # Identify the column in df_papers that stores co-authors
     # We will try common names. If none found, raise.
@@ -140,17 +96,21 @@ def collaboration_matrix_paper_level(df_papers: pd.DataFrame, cen_df: pd.DataFra
             if field:
                 areas.append(field)
 
-        # unique areas in this paper
-        uniq = sorted(set(areas))
+        # unique areas in this paper (sorted codes)
+        uniq = np.unique(np.fromiter((idx[a] for a in areas), dtype=np.int64, count=len(areas)))
         if len(uniq) < 2:
             continue
 
-        # increment each unordered pair once per paper
-        for a, b in combinations(uniq, 2):
-            mat.loc[a, b] += 1
-            mat.loc[b, a] += 1
+        # each unordered pair once per paper: upper-triangle index pairs, as flat i * n + j keys
+        i, j = np.triu_indices(len(uniq), k=1)
+        pair_keys.append(uniq[i] * n + uniq[j])
+
+    # One bincount for all papers, then mirror the upper triangle
+    keys = np.concatenate(pair_keys) if pair_keys else np.empty(0, dtype=np.int64)
+    upper = np.bincount(keys, minlength=n * n).reshape(n, n)
+    m = upper + upper.T
 
-    return mat
+    return pd.DataFrame(m, index=all_fields, columns=all_fields)
 
 
 def apply_threshold(mat: pd.DataFrame, min_value: int) -> pd.DataFrame:
@@ -1,6 +1,5 @@
 # pages/2_Collaborazioni_tra_aree_scientifiche.py
 import json
-from itertools import combinations
 from pathlib import Path
 
 import numpy as np
@@ -90,28 +89,32 @@ def collaboration_matrix_paper_level(df_papers: pd.DataFrame, cen_df: pd.DataFra
         fields = [f for f in fields if pd.notna(f)]
         fields_per_paper.append(fields)
 
-    counts: dict[tuple[str, str], int] = {}
+    census_fields = sorted(set(name_to_field.values()))
+    idx = {f: i for i, f in enumerate(census_fields)}
+    n = len(census_fields)
+
+    # Coppie uniche per paper: np.unique (codici ordinati) + triu_indices, come chiavi i * n + j
+    pair_keys: list[np.ndarray] = []
     for fields in fields_per_paper:
         if len(fields) < 2:
             continue
-        uniq = sorted(set(fields))
-        for f1, f2 in combinations(uniq, 2):
-            counts[(f1, f2)] = counts.get((f1, f2), 0) + 1
-
-    fields_all = sorted({x for pair in counts.keys() for x in pair})
-    mat = pd.DataFrame(0, index=fields_all, columns=fields_all, dtype=int)
+        uniq = np.unique(np.fromiter((idx[f] for f in fields), dtype=np.int64, count=len(fields)))
+        i, j = np.triu_indices(len(uniq), k=1)
+        pair_keys.append(uniq[i] * n + uniq[j])
 
-    for (a, b), v in counts.items():
-        mat.loc[a, b] += v
-        mat.loc[b, a] += v
+    keys = np.concatenate(pair_keys) if pair_keys else np.empty(0, dtype=np.int64)
+    upper = np.bincount(keys, minlength=n * n).reshape(n, n)
+    m = upper + upper.T
 
-    return mat
+    # Solo le aree che compaiono in almeno una coppia
+    keep = m.sum(axis=1) > 0
+    fields_all = [census_fields[k] for k in np.flatnonzero(keep)]
+    return pd.DataFrame(m[np.ix_(keep, keep)], index=fields_all, columns=fields_all)
 
 
 def apply_threshold(mat: pd.DataFrame, min_value: int) -> pd.DataFrame:
-    m = mat.copy()
-    m.values[m.values < min_value] = 0
-    return m
+    arr = mat.to_numpy()
+    return pd.DataFrame(np.where(arr >= min_value, arr, 0), index=mat.index, columns=mat.columns)
 
 
 def filter_fields(mat: pd.DataFrame, include_fields: list[str]) -> pd.DataFrame:
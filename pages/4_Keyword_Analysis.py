@@ -1,8 +1,17 @@
 # pages/4_Keyword_Analysis.py
-import json
+import base64
+import gzip
+import importlib.util
+import io
+import re
+from collections import Counter
+from collections.abc import Iterator
 from pathlib import Path
 
+import numpy as np
+import orjson
 import pandas as pd
+import pyarrow.parquet as pq
 import streamlit as st
 import streamlit.components.v1 as components
 
@@ -22,6 +31,31 @@ REPO_DIR = BASE_DIR.parent
 DATA_PATH = REPO_DIR / "data" / "processed" / "keyword_data.csv"
 LOGO_PATH = REPO_DIR / "logo.jpg"
 
+# The static renderer needs the optional `wordcloud` package; only offer it when installed
+HAS_WORDCLOUD = importlib.util.find_spec("wordcloud") is not None
+
+
+# ----------------------------
+# Tokenisation patterns (compiled once per process)
+# ----------------------------
+@st.cache_resource
+def split_patterns() -> dict[str, re.Pattern]:
+    """
+    Separator regex for each sidebar option, shared across sessions and reruns.
+    Rows are joined with NUL (not matched by \s), so every pattern also splits on it.
+    NUL is captured, so re.split reports row breaks ("\0") apart from separators (None).
+    """
+    return {
+        "Auto (consigliato)": re.compile(r"[,\n;]+|(\0)"),
+        "Virgola (,)": re.compile(r"[,]+|(\0)"),
+        "Punto e virgola (;)": re.compile(r"[;]+|(\0)"),
+        "Nuova riga": re.compile(r"[\n]+|(\0)"),
+    }
+
+
+SPLIT_PATTERNS = split_patterns()
+_WS_RE = re.compile(r"\s+")
+
 
 # ----------------------------
 # Load data
@@ -30,12 +64,49 @@ if not DATA_PATH.exists():
     st.error(f"File non trovato: {DATA_PATH}")
     st.stop()
 
-df = pd.read_csv(DATA_PATH)
 
-if "keywords_en" not in df.columns:
+CHUNK_ROWS = 50_000
+
+
+@st.cache_resource(show_spinner=False)
+def build_sidecar(path: Path, mtime: float) -> None:
+    """
+    (Re)build the Parquet sidecar next to the CSV when missing or older than it.
+    Runs once per process and CSV version (mtime is part of the cache key).
+    """
+    sidecar = path.with_suffix(".parquet")
+    if sidecar.exists() and sidecar.stat().st_mtime >= mtime:
+        return
+    df = pd.read_csv(path, usecols=["keywords_en"], engine="pyarrow", dtype_backend="pyarrow")
+    try:
+        df.to_parquet(sidecar, compression="zstd")
+    except OSError:
+        # Read-only deployment: iter_keyword_chunks falls back to the CSV.
+        pass
+
+
+def iter_keyword_chunks(path: Path) -> Iterator[list]:
+    """
+    Yield the 'keywords_en' column CHUNK_ROWS values at a time, so memory stays
+    bounded however large the file grows. Reads the Parquet sidecar when it is
+    up to date, otherwise streams the CSV.
+    """
+    sidecar = path.with_suffix(".parquet")
+    if sidecar.exists() and sidecar.stat().st_mtime >= path.stat().st_mtime:
+        for batch in pq.ParquetFile(sidecar).iter_batches(batch_size=CHUNK_ROWS, columns=["keywords_en"]):
+            yield batch.column(0).to_pylist()
+    else:
+        for chunk in pd.read_csv(path, usecols=["keywords_en"], chunksize=CHUNK_ROWS, dtype="string"):
+            yield chunk["keywords_en"].tolist()
+
+
+if "keywords_en" not in pd.read_csv(DATA_PATH, nrows=0).columns:
     st.error("Il CSV deve contenere una colonna chiamata 'keywords_en'.")
     st.stop()
 
+DATA_MTIME = DATA_PATH.stat().st_mtime
+build_sidecar(DATA_PATH, DATA_MTIME)
+
 
 # ----------------------------
 # Header
@@ -60,53 +131,6 @@ st.write("")
 # ----------------------------
 st.sidebar.header("Parametri")
 
-split_mode = st.sidebar.selectbox(
-    "Separatore parole chiave",
-    options=["Auto (consigliato)", "Virgola (,)", "Punto e virgola (;)", "Nuova riga"],
-    index=0,
-    help="Come separare le parole chiave presenti nella colonna 'keywords'.",
-)
-
-min_freq = st.sidebar.slider(
-    "Frequenza minima",
-    min_value=1,
-    max_value=50,
-    value=2,
-    step=1,
-    help="Mostra solo keyword con frequenza >= soglia.",
-)
-
-max_words = st.sidebar.slider(
-    "Numero massimo di keyword",
-    min_value=10,
-    max_value=250,
-    value=100,
-    step=10,
-    help="Limita il numero di keyword visualizzate (ordinate per frequenza).",
-)
-
-max_phrase_words = st.sidebar.slider(
-    "Lunghezza massima keyword (in parole)",
-    min_value=1,
-    max_value=12,
-    value=4,
-    step=1,
-    help="Filtra keyword troppo lunghe (es. frasi intere).",
-)
-
-palette = st.sidebar.selectbox(
-    "Palette colori",
-    ["set3", "tableau10", "paired"],
-    index=1,
-)
-
-rotate_mode = st.sidebar.selectbox(
-    "Rotazione",
-    ["Solo orizzontale", "0° / 90°"],
-    index=1,
-    help="Se 0°/90°, una parte delle keyword viene ruotata di 90°.",
-)
-
 DEFAULT_EXCLUSIONS = [
     "age-it",
     "ageit",
@@ -115,11 +139,75 @@ DEFAULT_EXCLUSIONS = [
     "literature review"
 ]
 
-exclude_text = st.sidebar.text_area(
-    "Escludi keyword (una per riga)",
-    value="\n".join(DEFAULT_EXCLUSIONS),
-    help="Inserisci le keyword da escludere. Il confronto è case-insensitive.",
-)
+# Widgets live in a form so a parameter change reruns the page once, on submit,
+# instead of once per slider tick.
+with st.sidebar.form("params"):
+    split_mode = st.selectbox(
+        "Separatore parole chiave",
+        options=list(SPLIT_PATTERNS),
+        index=0,
+        help="Come separare le parole chiave presenti nella colonna 'keywords'.",
+    )
+
+    min_freq = st.slider(
+        "Frequenza minima",
+        min_value=1,
+        max_value=50,
+        value=2,
+        step=1,
+        help="Mostra solo keyword con frequenza >= soglia.",
+    )
+
+    max_words = st.slider(
+        "Numero massimo di keyword",
+        min_value=10,
+        max_value=250,
+        value=100,
+        step=10,
+        help="Limita il numero di keyword visualizzate (ordinate per frequenza).",
+    )
+
+    max_phrase_words = st.slider(
+        "Lunghezza massima keyword (in parole)",
+        min_value=1,
+        max_value=12,
+        value=4,
+        step=1,
+        help="Filtra keyword troppo lunghe (es. frasi intere).",
+    )
+
+    palette = st.selectbox(
+        "Palette colori",
+        ["set3", "tableau10", "paired"],
+        index=1,
+    )
+
+    rotate_mode = st.selectbox(
+        "Rotazione",
+        ["Solo orizzontale", "0° / 90°"],
+        index=1,
+        help="Se 0°/90°, una parte delle keyword viene ruotata di 90°.",
+    )
+
+    render_mode = st.selectbox(
+        "Visualizzazione",
+        ["Interattiva (d3)", "Immagine statica"] if HAS_WORDCLOUD else ["Interattiva (d3)"],
+        index=0,
+        help=(
+            "L'immagine statica è generata sul server e messa in cache: più leggera per il browser, ma senza tooltip."
+            if HAS_WORDCLOUD
+            else "Installa il pacchetto `wordcloud` per abilitare l'immagine statica."
+        ),
+    )
+
+    exclude_text = st.text_area(
+        "Escludi keyword (una per riga)",
+        value="\n".join(DEFAULT_EXCLUSIONS),
+        help="Inserisci le keyword da escludere. Il confronto è case-insensitive.",
+    )
+
+    st.form_submit_button("Aggiorna", type="primary")
+
 exclude_set = {
     x.strip().lower()
     for x in exclude_text.splitlines()
@@ -130,56 +218,101 @@ exclude_set = {
 # ----------------------------
 # Build keyword frequency table
 # ----------------------------
-if split_mode == "Auto (consigliato)":
-    split_re = r"[,\n;]+"
-elif split_mode == "Virgola (,)":
-    split_re = r"[,]+"
-elif split_mode == "Punto e virgola (;)":
-    split_re = r"[;]+"
-else:
-    split_re = r"[\n]+"
-
-series = df["keywords_en"].fillna("").astype(str)
-
-tokens = (
-    series
-    .str.replace(r"\s+", " ", regex=True)
-    .str.split(split_re, regex=True)
-    .explode()
-    .astype(str)
-    .str.strip()
-    .str.lower()   # <-- normalise case
+def _count_chunk(
+    values: list,
+    split_mode: str,
+    max_phrase_words: int,
+    exclude_key: tuple[str, ...],
+) -> Counter:
+    """Tokenise one chunk of the keyword column and count its keywords."""
+    # Identical keyword strings repeat across rows: tokenise each distinct string
+    # once and weight its tokens by how many rows carry it.
+    codes, uniq = pd.factorize(pd.Series(values, dtype=object).fillna(""), sort=False)
+    if len(uniq) == 0:
+        return Counter()
+    weights = np.bincount(codes, minlength=len(uniq))
+
+    # Whitespace is collapsed once over the joined strings. re.split interleaves
+    # tokens with the captured group, so odd slots mark row breaks and give
+    # each token's source row.
+    parts = SPLIT_PATTERNS[split_mode].split(_WS_RE.sub(" ", "\0".join(uniq)))
+    row_breaks = np.fromiter((p is not None for p in parts[1::2]), dtype=bool, count=len(parts) // 2)
+    token_weights = weights[np.concatenate(([0], np.cumsum(row_breaks)))]
+
+    # Strip + lowercase run as two C loops over one contiguous unicode array
+    # (dtype=str sizes it to the longest token, so nothing is truncated).
+    arr = np.asarray(parts[::2], dtype=str)
+    arr = np.char.lower(np.char.strip(arr))
+
+    # Every filter is one boolean vector; they are OR-ed into a single mask and
+    # the survivors are compacted once. Tokens have single spaces, so
+    # n_words <= max <=> n_spaces < max. A token is pure punctuation (the old
+    # [\W_]+ fullmatch) iff it has no alphanumeric character.
+    is_empty = arr == ""
+    too_long = np.char.count(arr, " ") >= max_phrase_words
+    is_punct = np.fromiter(
+        (not any(c.isalnum() for c in t) for t in arr.tolist()),
+        dtype=bool,
+        count=arr.size,
+    )
+    if exclude_key:
+        in_excl = np.isin(arr, np.array(exclude_key, dtype=str))
+    else:
+        in_excl = np.zeros_like(is_empty)
+    keep = ~(is_empty | too_long | is_punct | in_excl)
+
+    # Weighted count of the survivors in C: unique tokens + bincount over their codes
+    uniq_tokens, inverse = np.unique(arr[keep], return_inverse=True)
+    totals = np.bincount(inverse, weights=token_weights[keep], minlength=uniq_tokens.size)
+    return Counter(dict(zip(uniq_tokens.tolist(), totals.astype(np.int64).tolist())))
+
+
+@st.cache_data(show_spinner=False, persist="disk", max_entries=16)
+def compute_counts(
+    path: Path,
+    mtime: float,
+    split_mode: str,
+    max_phrase_words: int,
+    exclude_key: tuple[str, ...],
+) -> pd.DataFrame:
+    """
+    Stream the keyword column chunk by chunk into a single Counter.
+    Returns a (text, count) DataFrame sorted by descending frequency.
+    mtime is part of the cache key so an updated CSV invalidates the disk cache;
+    exclude_key is a sorted tuple (a set/frozenset hashes in PYTHONHASHSEED order,
+    so its key would change on every restart);
+    min_freq / max_words are applied by the caller, outside the cache.
+    """
+    counts: Counter = Counter()
+    for chunk in iter_keyword_chunks(path):
+        counts.update(_count_chunk(chunk, split_mode, max_phrase_words, exclude_key))
+    return pd.DataFrame(counts.most_common(), columns=["text", "count"])
+
+
+count_df = compute_counts(
+    DATA_PATH,
+    DATA_MTIME,
+    split_mode,
+    max_phrase_words,
+    tuple(sorted(exclude_set)),
 )
-if exclude_set:
-    tokens = tokens[~tokens.isin(exclude_set)]
-
-tokens = tokens[tokens != ""]
-tokens = tokens[~tokens.str.fullmatch(r"[\W_]+", na=False)]
-tokens = tokens[tokens.str.split().str.len() <= max_phrase_words]
-
-count_df = tokens.value_counts().reset_index()
-count_df.columns = ["text", "count"]
 count_df = count_df[count_df["count"] >= min_freq].head(max_words)
 
 if count_df.empty:
     st.warning("Nessuna keyword soddisfa i filtri selezionati.")
     st.stop()
 
-words = count_df.to_dict(orient="records")
+# Hashable (text, count) pairs: cache key for the rendered HTML below
+words_key = tuple(zip(count_df["text"].tolist(), count_df["count"].tolist()))
 
 
 # ----------------------------
 # D3 Word Cloud HTML (NO f-string)
 # ----------------------------
-def wordcloud_html(words_list, palette_name, rotate_choice) -> str:
-    payload = {
-        "words": words_list,
-        "palette": palette_name,
-        "rotate_mode": rotate_choice,
-    }
-    data_json = json.dumps(payload, ensure_ascii=False)
-
-    html = """
+@st.cache_resource
+def wordcloud_template() -> str:
+    """Static d3-cloud page; only the __PAYLOAD__ placeholder changes between renders."""
+    return """
 <!doctype html>
 <html>
 <head>
@@ -213,9 +346,11 @@ def wordcloud_html(words_list, palette_name, rotate_choice) -> str:
 <body>
 <div id="wc"></div>
 
-<script>
-  const payload = __PAYLOAD__;
-  const wordsIn = payload.words;
+<script type="module">
+  const gz = Uint8Array.from(atob("__PAYLOAD__"), c => c.charCodeAt(0));
+  const inflated = new Blob([gz]).stream().pipeThrough(new DecompressionStream("gzip"));
+  const payload = JSON.parse(await new Response(inflated).text());
+  const words = payload.words;
   const palette = payload.palette;
   const rotateMode = payload.rotate_mode;
 
@@ -230,19 +365,6 @@ def wordcloud_html(words_list, palette_name, rotate_choice) -> str:
   const width = 1100;
   const height = 520;
 
-  const maxCount = d3.max(wordsIn, d => d.count);
-  const minCount = d3.min(wordsIn, d => d.count);
-
-  const fontScale = d3.scaleSqrt()
-    .domain([minCount, maxCount])
-    .range([14, 72]);
-
-  const words = wordsIn.map(d => ({
-    text: d.text,
-    count: d.count,
-    size: fontScale(d.count)
-  }));
-
   const tooltip = d3.select("body")
     .append("div")
     .attr("class", "tooltip")
@@ -298,20 +420,81 @@ def wordcloud_html(words_list, palette_name, rotate_choice) -> str:
 </body>
 </html>
 """
-    return html.replace("__PAYLOAD__", data_json)
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def wordcloud_html(words_key: tuple[tuple[str, int], ...], palette_name: str, rotate_choice: str) -> str:
+    # Font size in px, same mapping as d3.scaleSqrt().domain([min, max]).range([14, 72])
+    # (a degenerate domain maps to the midpoint), so the browser only lays out.
+    sqrt_counts = np.sqrt(np.array([count for _, count in words_key], dtype=float))
+    lo, hi = sqrt_counts.min(), sqrt_counts.max()
+    scaled = (sqrt_counts - lo) / (hi - lo) if hi > lo else np.full_like(sqrt_counts, 0.5)
+    sizes = np.rint(14 + (72 - 14) * scaled).astype(int).tolist()
+
+    payload = {
+        "words": [
+            {"text": text, "count": count, "size": size}
+            for (text, count), size in zip(words_key, sizes)
+        ],
+        "palette": palette_name,
+        "rotate_mode": rotate_choice,
+    }
+    # orjson emits UTF-8 bytes directly. Ship them gzipped + base64;
+    # the iframe inflates the payload with DecompressionStream.
+    data_b64 = base64.b64encode(gzip.compress(orjson.dumps(payload))).decode("ascii")
+    return wordcloud_template().replace("__PAYLOAD__", data_b64)
+
+
+# ----------------------------
+# Static PNG word cloud (server-side)
+# ----------------------------
+WORDCLOUD_COLORMAPS = {
+    "set3": "Set3",
+    "tableau10": "tab10",
+    "paired": "Paired",
+}
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def wordcloud_png(words_key: tuple[tuple[str, int], ...], palette_name: str, rotate_choice: str) -> bytes:
+    """
+    Lay out the cloud on the server with the `wordcloud` package and return PNG bytes.
+    Identical parameter sets are served from the cache, so the browser does no layout work.
+    """
+    # Imported here so the interactive view keeps working without the package.
+    from wordcloud import WordCloud
+
+    wc = WordCloud(
+        width=1100,
+        height=520,
+        background_color="white",
+        colormap=WORDCLOUD_COLORMAPS.get(palette_name, "Set3"),
+        prefer_horizontal=1.0 if rotate_choice == "Solo orizzontale" else 0.75,
+        min_font_size=14,
+        max_font_size=72,
+        max_words=len(words_key),
+        random_state=0,
+    ).generate_from_frequencies(dict(words_key))
+
+    buf = io.BytesIO()
+    wc.to_image().save(buf, format="PNG")
+    return buf.getvalue()
 
 
 # ----------------------------
 # Render
 # ----------------------------
-components.html(
-    wordcloud_html(words, palette, rotate_mode),
-    height=650,
-    scrolling=False,
-)
+if render_mode == "Immagine statica":
+    st.image(wordcloud_png(words_key, palette, rotate_mode))
+else:
+    components.html(
+        wordcloud_html(words_key, palette, rotate_mode),
+        height=650,
+        scrolling=False,
+    )
 
 st.caption(
     "La word cloud mostra le keyword estratte dalla colonna 'keywords'. "
     "Le keyword vengono separate secondo il separatore scelto, aggregate per frequenza e visualizzate con dimensione proporzionale alla frequenza. "
-    "Passa il mouse su una keyword per vedere la frequenza."
+    + ("" if render_mode == "Immagine statica" else "Passa il mouse su una keyword per vedere la frequenza.")
 )
\ No newline at end of file
@@ -1,8 +1,8 @@
 # app.py
-import json
-from itertools import combinations
+import base64
 
 import numpy as np
+import orjson
 import pandas as pd
 import streamlit as st
 import streamlit.components.v1 as components
@@ -11,108 +11,192 @@ import streamlit.components.v1 as components
 # ----------------------------
 # Data prep utilities
 # ----------------------------
-def normalise_name(s: str) -> str:
-    if pd.isna(s):
-        return ""
-    s = str(s).strip()
-    s = " ".join(s.split())
-    return s
-
-
-def parse_authors(authors_full: str) -> list[str]:
-    if pd.isna(authors_full):
-        return []
-    out = [normalise_name(a) for a in str(authors_full).split(",")]
-    return [a for a in out if a]
+def normalise_names(s: pd.Series) -> pd.Series:
+    """Trim and collapse whitespace (Unicode spaces such as NBSP included); missing -> ""."""
+    return s.fillna("").astype(str).str.split().str.join(" ")
 
 
+@st.cache_data(show_spinner=False)
 def build_name_to_field(cen: pd.DataFrame) -> dict:
-    cen2 = cen.copy()
-    cen2["full_name"] = cen2["full_name"].astype(str).map(normalise_name)
-    cen2["Area_desc"] = cen2["Area_desc"].astype(str).map(lambda x: " ".join(str(x).split()))
+    names = normalise_names(cen["full_name"])
+    fields = normalise_names(cen["Area_desc"])
 
-    cen2 = cen2.dropna(subset=["full_name", "Area_desc"])
-    cen2 = cen2[cen2["full_name"].ne("") & cen2["Area_desc"].ne("")]
+    mask = names.ne("") & fields.ne("")
+    names, fields = names[mask], fields[mask]
 
     # If duplicates exist, keep first. Adjust policy if needed.
-    cen2 = cen2.drop_duplicates(subset=["full_name"], keep="first")
+    first = ~names.duplicated(keep="first")
+    return dict(zip(names[first].to_numpy(), fields[first].to_numpy()))
+
+
+# ----------------------------
+# Packed symmetric matrices: the upper triangle (diagonal included), row-major
+# in np.triu_indices(n) order, holding n * (n + 1) / 2 values instead of n * n
+# ----------------------------
+def triu_pack_index(i: np.ndarray, j: np.ndarray, n: int) -> np.ndarray:
+    """Position of cell (i, j), i <= j, in the packed upper triangle."""
+    return i * (2 * n - i + 1) // 2 + (j - i)
+
+
+def triu_row_sums(upper: np.ndarray, n: int) -> np.ndarray:
+    ii, jj = np.triu_indices(n)
+    off_diag = np.where(ii != jj, upper, 0)
+    return np.bincount(ii, weights=upper, minlength=n) + np.bincount(jj, weights=off_diag, minlength=n)
+
+
+def triu_subset(upper: np.ndarray, n: int, keep: np.ndarray) -> np.ndarray:
+    """Packed triangle of the kept rows/cols (row-major order survives the mask)."""
+    ii, jj = np.triu_indices(n)
+    return upper[keep[ii] & keep[jj]]
 
-    return cen2.set_index("full_name")["Area_desc"].to_dict()
 
+def triu_to_dense(upper: np.ndarray, n: int) -> np.ndarray:
+    M = np.zeros((n, n), dtype=upper.dtype)
+    ii, jj = np.triu_indices(n)
+    M[ii, jj] = upper
+    M[jj, ii] = upper
+    return M
 
-def collaboration_matrix(df: pd.DataFrame, cen: pd.DataFrame, mode: str = "pairwise") -> pd.DataFrame:
+
+def accumulate_pairs(codes_flat: np.ndarray, offsets: np.ndarray, n: int, paper_level: bool) -> np.ndarray:
     """
-    mode:
-      - pairwise: counts all co-author pairs (field-field counts grow with team size)
-      - paper_level: each field-field pair counts at most once per paper
+    Field-pair counts from CSR paper lists (paper p owns codes_flat[offsets[p]:offsets[p + 1]]),
+    returned as a packed upper triangle. Every paper's pairs are enumerated at once with
+    repeat/arange arithmetic, so there is no per-paper Python loop.
     """
-    name_to_field = build_name_to_field(cen)
+    codes_flat = np.asarray(codes_flat, dtype=np.int64)
+    paper_of = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
 
-    if "authors_full" not in df.columns:
-        raise ValueError("df must contain a column named 'authors_full'.")
-    if not {"full_name", "Area_desc"}.issubset(set(cen.columns)):
-        raise ValueError("cen must contain columns: 'full_name' and 'Area_desc'.")
+    if paper_level:
+        # Keep one occurrence of each field per paper (np.unique also sorts by paper)
+        key = np.unique(paper_of * n + codes_flat)
+        paper_of, codes_flat = key // n, key % n
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(paper_of, minlength=len(offsets) - 1))))
 
-    fields_per_paper = []
-    for s in df["authors_full"]:
-        authors = parse_authors(s)
-        fields = [name_to_field.get(a, np.nan) for a in authors]
-        fields = [f for f in fields if pd.notna(f)]
-        fields_per_paper.append(fields)
+    # Element g pairs with every later element of its own paper
+    pos = np.arange(len(codes_flat))
+    partners = offsets[1:][paper_of] - pos - 1
+    first = np.repeat(pos, partners)
+    run_start = np.repeat(np.cumsum(partners) - partners, partners)
+    second = first + 1 + (np.arange(len(first)) - run_start)
 
-    counts: dict[tuple[str, str], int] = {}
+    a, b = codes_flat[first], codes_flat[second]
+    upper = np.bincount(triu_pack_index(np.minimum(a, b), np.maximum(a, b), n), minlength=n * (n + 1) // 2)
 
-    for fields in fields_per_paper:
-        if len(fields) < 2:
-            continue
+    # Same-field pairs sit on the diagonal, which the dense matrix counts from both sides
+    diag = np.arange(n)
+    upper[triu_pack_index(diag, diag, n)] *= 2
+    return upper
 
-        if mode == "pairwise":
-            for f1, f2 in combinations(fields, 2):
-                a, b = sorted((f1, f2))
-                counts[(a, b)] = counts.get((a, b), 0) + 1
 
-        elif mode == "paper_level":
-            uniq = sorted(set(fields))
-            for f1, f2 in combinations(uniq, 2):
-                counts[(f1, f2)] = counts.get((f1, f2), 0) + 1
+@st.cache_data(show_spinner=False)
+def _papers_to_code_lists(df: pd.DataFrame, cen: pd.DataFrame) -> tuple[np.ndarray, np.ndarray, list[str]]:
+    """
+    Mode-independent part of collaboration_matrix, cached so widget changes skip it.
+    Returns CSR-style field codes: paper p owns codes_flat[offsets[p]:offsets[p + 1]],
+    and code i stands for fields_all[i] (sorted).
+    """
+    name_to_field = build_name_to_field(cen)
 
-        else:
-            raise ValueError("mode must be 'pairwise' or 'paper_level'")
+    # Census side of the join: one row per name, field as a sorted integer code
+    census_names = pd.Index(list(name_to_field))
+    census_codes, fields_all = pd.factorize(pd.Series(list(name_to_field.values()), dtype=object), sort=True)
 
-    fields_all = sorted({x for pair in counts.keys() for x in pair})
-    mat = pd.DataFrame(0, index=fields_all, columns=fields_all, dtype=int)
+    # Paper side: long (paper, author) table, parsed with vectorised string ops.
+    # The index after explode is the paper position.
+    authors = df["authors_full"].reset_index(drop=True).fillna("").astype(str).str.split(",").explode()
+    authors = normalise_names(authors)
+    authors = authors[authors.ne("")]
+    paper_of = authors.index.to_numpy(dtype=np.int64)
 
-    for (a, b), v in counts.items():
-        mat.loc[a, b] += v
-        mat.loc[b, a] += v
+    # Hash join on the name index; authors missing from the census get -1 and are dropped
+    hit = census_names.get_indexer(authors.to_numpy())
+    matched = hit >= 0
+    codes_flat = census_codes[hit[matched]]
+    counts = np.bincount(paper_of[matched], minlength=len(df))
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    return codes_flat, offsets, fields_all.tolist()
 
-    return mat
+
+@st.cache_data(show_spinner=False)
+def collaboration_matrix(df: pd.DataFrame, cen: pd.DataFrame, mode: str = "pairwise") -> tuple[list[str], np.ndarray]:
+    """
+    Returns (labels, upper): the packed upper triangle of the symmetric matrix whose
+    [i, j] cell counts collaborations between labels[i] and labels[j] (see triu_to_dense).
+    mode:
+      - pairwise: counts all co-author pairs (field-field counts grow with team size)
+      - paper_level: each field-field pair counts at most once per paper
+    """
+    if "authors_full" not in df.columns:
+        raise ValueError("df must contain a column named 'authors_full'.")
+    if not {"full_name", "Area_desc"}.issubset(set(cen.columns)):
+        raise ValueError("cen must contain columns: 'full_name' and 'Area_desc'.")
+    if mode not in ("pairwise", "paper_level"):
+        raise ValueError("mode must be 'pairwise' or 'paper_level'")
+
+    codes_flat, offsets, fields_all = _papers_to_code_lists(df, cen)
+    n = len(fields_all)
+    upper = accumulate_pairs(codes_flat, offsets, n, paper_level=(mode == "paper_level"))
+
+    # Keep only fields that take part in at least one pair
+    keep = triu_row_sums(upper, n) > 0
+    labels = [fields_all[i] for i in np.flatnonzero(keep)]
+    return labels, triu_subset(upper, n, keep)
 
 
-def apply_threshold(mat: pd.DataFrame, min_value: int) -> pd.DataFrame:
-    m = mat.copy()
-    m.values[m.values < min_value] = 0
-    return m
+def apply_threshold(M: np.ndarray, min_value: int, inplace: bool = False) -> np.ndarray:
+    if inplace:
+        # Caller owns M (e.g. a fresh copy out of st.cache_data): zero it without a second N x N buffer
+        np.putmask(M, M < min_value, 0)
+        return M
+    return np.where(M >= min_value, M, 0)
 
 
 # ----------------------------
 # D3 chord HTML generator
 # ----------------------------
-def chord_html(labels: list[str], matrix: list[list[int]], palette: str, sort_mode: str) -> str:
+def presort_chord(labels: list[str], M: np.ndarray, sort_mode: str) -> tuple[list[str], np.ndarray, list[int], str]:
+    """
+    Apply "groups_desc" as a row/column permutation here instead of d3's sortGroups.
+    Returns (labels, M, color_index, sort_mode left for d3): color_index[k] is the
+    pre-sort position of group k, so fields keep their palette colour.
+    """
+    order = np.arange(len(labels))
+    if sort_mode == "groups_desc":
+        # Stable, like the JS sort it replaces: ties keep field order
+        order = np.argsort(-M.sum(axis=1), kind="stable")
+        M = M[np.ix_(order, order)]
+        labels = [labels[i] for i in order]
+        sort_mode = "none"
+    return labels, M, order.tolist(), sort_mode
+
+
+def chord_html(
+    labels: list[str],
+    matrix: np.ndarray | list[list[int]],
+    palette: str,
+    sort_mode: str,
+    color_index: list[int] | None = None,
+) -> str:
     palettes = {
         "tableau10": ["#4E79A7","#F28E2B","#E15759","#76B7B2","#59A14F","#EDC948","#B07AA1","#FF9DA7","#9C755F","#BAB0AC"],
         "set3": ["#8DD3C7","#FFFFB3","#BEBADA","#FB8072","#80B1D3","#FDB462","#B3DE69","#FCCDE5","#D9D9D9","#BC80BD","#CCEBC5","#FFED6F"],
         "paired": ["#A6CEE3","#1F78B4","#B2DF8A","#33A02C","#FB9A99","#E31A1C","#FDBF6F","#FF7F00","#CAB2D6","#6A3D9A","#FFFF99","#B15928"],
     }
     colors = palettes.get(palette, palettes["tableau10"])
+    if color_index is not None:
+        colors = [colors[i % len(colors)] for i in color_index]
 
+    # Matrix travels as base64 little-endian int32 (row-major) instead of nested JSON numbers
+    flat = np.ascontiguousarray(matrix, dtype="<i4")
     payload = {
         "labels": labels,
-        "matrix": matrix,
+        "n": len(labels),
+        "matrix_b64": base64.b64encode(flat.tobytes()).decode("ascii"),
         "colors": colors,
         "sort_mode": sort_mode,
     }
-    data_json = json.dumps(payload)
+    data_json = orjson.dumps(payload).decode()
 
     return f"""
 <!doctype html>
@@ -158,7 +242,10 @@ def chord_html(labels: list[str], matrix: list[list[int]], palette: str, sort_mo
   <script>
     const payload = {data_json};
     const labels = payload.labels;
-    const matrix = payload.matrix;
+    const n = payload.n;
+    const raw = Uint8Array.from(atob(payload.matrix_b64), c => c.charCodeAt(0));
+    const flat = new Int32Array(raw.buffer);
+    const matrix = Array.from({{length: n}}, (_, i) => Array.from(flat.subarray(i * n, (i + 1) * n)));
     const colors = payload.colors;
     const sortMode = payload.sort_mode;
 
@@ -267,6 +354,15 @@ def chord_html(labels: list[str], matrix: list[list[int]], palette: str, sort_mo
 """
 
 
+@st.cache_data(show_spinner=False, max_entries=64)
+def chord_html_cached(
+    labels: tuple[str, ...], matrix_bytes: bytes, palette: str, sort_mode: str, color_index: tuple[int, ...]
+) -> str:
+    """chord_html keyed on hashable inputs, so reruns with the same matrix skip serialisation."""
+    matrix = np.frombuffer(matrix_bytes, dtype=np.int64).reshape(len(labels), -1)
+    return chord_html(list(labels), matrix, palette, sort_mode, list(color_index))
+
+
 # ----------------------------
 # Streamlit UI
 # ----------------------------
@@ -302,15 +398,17 @@ if "df" not in globals() or "cen" not in globals():
     st.warning("This app expects `df` (column `authors_full`) and `cen` (columns `full_name`, `Area_desc`) to be defined or loaded.")
     st.stop()
 
-mat = collaboration_matrix(df=df, cen=cen, mode=mode)
-mat = apply_threshold(mat, min_value=min_value)
+labels, upper = collaboration_matrix(df=df, cen=cen, mode=mode)
+upper = apply_threshold(upper, min_value=min_value, inplace=True)
 
 # Remove all-zero rows/cols after thresholding
-nonzero = (mat.sum(axis=1) > 0)
-mat = mat.loc[nonzero, nonzero]
+keep = triu_row_sums(upper, len(labels)) > 0
+upper = triu_subset(upper, len(labels), keep)
+labels = [labels[i] for i in np.flatnonzero(keep)]
 
-labels = mat.index.tolist()
-matrix = mat.values.tolist()
+# Dense N x N only from here on, for sorting and the D3 payload
+M = triu_to_dense(upper, len(labels))
+labels, M, color_index, chord_sort = presort_chord(labels, M, sort_mode)
 
 col1, col2 = st.columns([2, 1], vertical_alignment="top")
 
@@ -318,9 +416,10 @@ with col1:
     if not labels:
         st.info("No collaborations remain after thresholding. Lower the threshold.")
     else:
-        components.html(chord_html(labels, matrix, palette, sort_mode), height=720, scrolling=False)
+        html = chord_html_cached(tuple(labels), M.astype(np.int64).tobytes(), palette, chord_sort, tuple(color_index))
+        components.html(html, height=720, scrolling=False)
 
 with col2:
     st.subheader("Matrix preview")
     st.write(f"Fields: {len(labels)}")
-    st.dataframe(mat)
\ No newline at end of file
+    st.dataframe(pd.DataFrame(M, index=labels, columns=labels))
\ No newline at end of file
@@ -19,17 +19,26 @@ from __future__ import annotations
 
 import argparse
 import csv
-import json
 import os
 import random
 import re
 import time
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from typing import List, Optional, Tuple
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+
+from openrouter_utils import RateLimiter
 
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+OUTPUT_FIELDS = ["title", "keywords"]
+FLUSH_EVERY = 50  # rows between explicit flushes of the output file
+
+_FENCED = re.compile(r"```(?:json)?\s*(\{.*?\})\s*```", re.DOTALL)
+_BRACE = re.compile(r"(\{.*\})", re.DOTALL)
 
 
 @dataclass
@@ -40,6 +49,13 @@ class ORConfig:
     max_retries: int = 6
     base_backoff_s: float = 1.5
     rate_limit_s: float = 0.2  # increase if you hit 429
+    rate_burst: int = 8  # request starts allowed back-to-back after an idle spell
+    # Shared keep-alive connection pool; mount an HTTPAdapter sized to the worker count.
+    session: requests.Session = field(default_factory=requests.Session, repr=False)
+    limiter: RateLimiter = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.limiter = RateLimiter(self.rate_limit_s, self.rate_burst)
 
 
 def build_system_prompt() -> str:
@@ -62,32 +78,58 @@ def build_system_prompt() -> str:
     )
 
 
+def build_batch_system_prompt() -> str:
+    return (
+        "Sei un estrattore di keyword da TITOLI di paper scientifici.\n"
+        "Riceverai piu' titoli numerati. Per ciascun titolo estrai fino a 4 keyword (massimo 4) che siano:\n"
+        "- brevi (1-3 parole),\n"
+        "- pertinenti e non ridondanti,\n"
+        "- non troppo generiche (evita 'study', 'analysis', 'approach' se possibile),\n"
+        "- in italiano se il titolo lo suggerisce, altrimenti in inglese.\n\n"
+        "Rispondi ESCLUSIVAMENTE in JSON valido, senza testo extra.\n"
+        "Schema:\n"
+        "{\n"
+        '  "results": [{"i": 0, "keywords": ["kw1", "kw2", "kw3", "kw4"]}, ...]\n'
+        "}\n"
+        "Regole:\n"
+        "- Un elemento per ogni titolo, con \"i\" uguale al numero del titolo.\n"
+        "- Ogni lista deve contenere 1-4 elementi.\n"
+        "- Nessun elemento vuoto.\n"
+        "- Nessuna keyword duplicata (case-insensitive) all'interno dello stesso titolo.\n"
+    )
+
+
 def build_user_prompt(title: str) -> str:
     return f'Titolo: "{title}"\nEstrai fino a 4 keyword.'
 
 
+def build_batch_user_prompt(titles: List[str]) -> str:
+    lines = "\n".join(f'{i}: "{t}"' for i, t in enumerate(titles))
+    return f"Titoli:\n{lines}\nEstrai fino a 4 keyword per ciascun titolo."
+
+
 def extract_json(text: str) -> Optional[dict]:
     text = text.strip()
 
     # direct
     try:
-        return json.loads(text)
+        return orjson.loads(text)
     except Exception:
         pass
 
     # fenced
-    m = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", text, flags=re.DOTALL)
+    m = _FENCED.search(text)
     if m:
         try:
-            return json.loads(m.group(1))
+            return orjson.loads(m.group(1))
         except Exception:
             pass
 
     # first { ... }
-    m = re.search(r"(\{.*\})", text, flags=re.DOTALL)
+    m = _BRACE.search(text)
     if m:
         try:
-            return json.loads(m.group(1))
+            return orjson.loads(m.group(1))
         except Exception:
             pass
 
@@ -105,28 +147,41 @@ def validate_keywords(obj: dict) -> Optional[List[str]]:
     if not isinstance(kws, list):
         return None
 
-    cleaned: List[str] = []
-    seen = set()
-    for k in kws:
-        if not isinstance(k, str):
-            k = str(k)
-        k = normalise_kw(k)
-        if not k:
-            continue
-        key = k.casefold()
-        if key in seen:
-            continue
-        seen.add(key)
-        cleaned.append(k)
-        if len(cleaned) == 4:
-            break
+    # casefold key -> first spelling seen; dict order keeps first appearance
+    first: dict = {}
+    for k in map(normalise_kw, map(str, kws)):
+        if k:
+            first.setdefault(k.casefold(), k)
+    cleaned = list(first.values())[:4]
 
     if not (1 <= len(cleaned) <= 4):
         return None
     return cleaned
 
 
-def openrouter_extract_keywords(cfg: ORConfig, system_prompt: str, title: str) -> List[str]:
+def validate_batch(obj: dict, n: int) -> Optional[List[Optional[List[str]]]]:
+    """Per-title keywords by index; None where an entry is missing or invalid."""
+    if not isinstance(obj, dict):
+        return None
+    results = obj.get("results")
+    if not isinstance(results, list):
+        return None
+
+    out: List[Optional[List[str]]] = [None] * n
+    for entry in results:
+        if not isinstance(entry, dict):
+            continue
+        i = entry.get("i")
+        if not isinstance(i, int) or not (0 <= i < n) or out[i] is not None:
+            continue
+        out[i] = validate_keywords(entry)
+
+    if all(kws is None for kws in out):
+        return None
+    return out
+
+
+def _openrouter_json(cfg: ORConfig, system_prompt: str, user_prompt: str, validate):
     headers = {
         "Authorization": f"Bearer {cfg.api_key}",
         "Content-Type": "application/json",
@@ -140,7 +195,7 @@ def openrouter_extract_keywords(cfg: ORConfig, system_prompt: str, title: str) -
         "temperature": 0.0,
         "messages": [
             {"role": "system", "content": system_prompt},
-            {"role": "user", "content": build_user_prompt(title)},
+            {"role": "user", "content": user_prompt},
         ],
         # Encourage strict JSON output
         "response_format": {"type": "json_object"},
@@ -148,24 +203,25 @@ def openrouter_extract_keywords(cfg: ORConfig, system_prompt: str, title: str) -
 
     for attempt in range(cfg.max_retries):
         try:
-            r = requests.post(OPENROUTER_URL, headers=headers, json=payload, timeout=cfg.timeout_s)
+            cfg.limiter.wait()
+            r = cfg.session.post(OPENROUTER_URL, headers=headers, data=orjson.dumps(payload), timeout=cfg.timeout_s)
             if r.status_code == 429:
                 backoff = cfg.base_backoff_s * (2 ** attempt) + random.random()
                 time.sleep(backoff)
                 continue
             r.raise_for_status()
 
-            data = r.json()
+            data = orjson.loads(r.content)
             content = data["choices"][0]["message"]["content"]
             obj = extract_json(content)
             if obj is None:
                 raise ValueError(f"Could not parse JSON. Raw content: {content[:300]}")
 
-            kws = validate_keywords(obj)
-            if kws is None:
+            result = validate(obj)
+            if result is None:
                 raise ValueError(f"Invalid keywords JSON: {obj}")
 
-            return kws
+            return result
 
         except Exception:
             if attempt == cfg.max_retries - 1:
@@ -176,6 +232,32 @@ def openrouter_extract_keywords(cfg: ORConfig, system_prompt: str, title: str) -
     raise RuntimeError("Unexpected retry loop termination.")
 
 
+def openrouter_extract_keywords(cfg: ORConfig, system_prompt: str, title: str) -> List[str]:
+    return _openrouter_json(cfg, system_prompt, build_user_prompt(title), validate_keywords)
+
+
+def openrouter_extract_batch(
+    cfg: ORConfig, system_prompt: str, titles: List[str]
+) -> List[Tuple[str, List[str]]]:
+    """
+    Extract keywords for several titles in one request.
+    Titles the batch answer leaves out (or the whole batch, on failure) are
+    retried one at a time with the single-title prompt.
+    """
+    try:
+        batch = _openrouter_json(
+            cfg, system_prompt, build_batch_user_prompt(titles), lambda obj: validate_batch(obj, len(titles))
+        )
+    except Exception:
+        batch = [None] * len(titles)
+
+    single_prompt = build_system_prompt()
+    return [
+        (t, kws if kws is not None else openrouter_extract_keywords(cfg, single_prompt, t))
+        for t, kws in zip(titles, batch)
+    ]
+
+
 def iter_input_titles(input_path: str, title_col: str):
     with open(input_path, newline="", encoding="utf-8") as f:
         reader = csv.DictReader(f)
@@ -199,34 +281,27 @@ def load_done_titles(output_path: str) -> set:
     return done
 
 
-def append_output_row(output_path: str, title: str, keywords: List[str]) -> None:
-    file_exists = os.path.exists(output_path)
-    with open(output_path, "a", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=["title", "keywords"])
-        if not file_exists:
-            writer.writeheader()
-        writer.writerow({
-            "title": title,
-            # store as a single string; easy to read in Excel/pandas
-            "keywords": ", ".join(keywords),
-        })
-
-
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--input", required=True, help="Input CSV path")
     ap.add_argument("--output", required=True, help="Output CSV path (will contain only: title, keywords)")
     ap.add_argument("--title-col", default="title", help="Input column containing titles")
     ap.add_argument("--model", default="openai/gpt-4o-mini", help="OpenRouter model name")
-    ap.add_argument("--rate-limit", type=float, default=0.2, help="Sleep seconds between requests")
+    ap.add_argument("--rate-limit", type=float, default=0.2, help="Average seconds between request starts")
+    ap.add_argument("--burst", type=int, default=8, help="Request starts allowed back-to-back before --rate-limit applies")
+    ap.add_argument("--workers", type=int, default=8, help="Concurrent requests in flight")
+    ap.add_argument("--batch-size", type=int, default=20, help="Titles sent per request (1 = one title per call)")
     args = ap.parse_args()
 
     api_key = os.environ.get("OPENROUTER_API_KEY", "").strip()
     if not api_key:
         raise SystemExit("Missing OPENROUTER_API_KEY env var.")
 
-    cfg = ORConfig(api_key=api_key, model=args.model, rate_limit_s=args.rate_limit)
-    system_prompt = build_system_prompt()
+    workers = max(1, args.workers)
+    cfg = ORConfig(api_key=api_key, model=args.model, rate_limit_s=args.rate_limit, rate_burst=args.burst)
+    cfg.session.mount("https://", HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=0))
+    batch_size = max(1, args.batch_size)
+    system_prompt = build_batch_system_prompt() if batch_size > 1 else build_system_prompt()
 
     done = load_done_titles(args.output)
 
@@ -234,22 +309,44 @@ def main():
     skipped = 0
     total = 0
 
+    todo: List[str] = []
     for title in iter_input_titles(args.input, args.title_col):
         total += 1
         if title in done:
             skipped += 1
             continue
-
-        kws = openrouter_extract_keywords(cfg, system_prompt, title)
-        append_output_row(args.output, title, kws)
-
         done.add(title)
-        processed += 1
-
-        time.sleep(cfg.rate_limit_s)
-
-        if (processed + skipped) % 100 == 0:
-            print(f"Progress: seen={processed+skipped} | processed={processed} | skipped={skipped}")
+        todo.append(title)
+
+    first = not os.path.exists(args.output)
+    out_f = open(args.output, "a", newline="", encoding="utf-8", buffering=1 << 16)
+    writer = csv.DictWriter(out_f, fieldnames=OUTPUT_FIELDS)
+    if first:
+        writer.writeheader()
+
+    # Requests run on worker threads; rows are written from this thread only, in input order
+    # (each future is awaited in submission order, so later ones keep running meanwhile).
+    with out_f, cfg.session, ThreadPoolExecutor(max_workers=workers) as ex:
+        if batch_size > 1:
+            batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+            futures = [ex.submit(openrouter_extract_batch, cfg, system_prompt, b) for b in batches]
+        else:
+            futures = [ex.submit(lambda t: [(t, openrouter_extract_keywords(cfg, system_prompt, t))], t) for t in todo]
+        try:
+            for fut in futures:
+                before = processed
+                for title, kws in fut.result():
+                    # store keywords as a single string; easy to read in Excel/pandas
+                    writer.writerow({"title": title, "keywords": ", ".join(kws)})
+                    processed += 1
+                    if processed % FLUSH_EVERY == 0:
+                        out_f.flush()
+
+                if processed // 100 > before // 100:
+                    print(f"Progress: processed={processed}/{len(todo)} | skipped={skipped}")
+        except BaseException:
+            ex.shutdown(wait=True, cancel_futures=True)
+            raise
 
     print(f"Done. input_titles={total} | processed={processed} | skipped={skipped} | output={args.output}")
 
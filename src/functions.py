@@ -1,6 +1,13 @@
+import os
 import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
-from bs4 import BeautifulSoup
+from lxml import etree
+from lxml import html as lxml_html
+from requests.adapters import HTTPAdapter
 
 
 DOCENTI_URL_DEFAULT = (
@@ -12,6 +19,62 @@ ASSEGNASTI_URL_DEFAULT = (
     "settore=0000&area=0000&situazione_al=0&vai=Invio"
 )
 
+# Rows of the first results table (header row skipped by the caller), matched on the class token
+_RESULT_ROWS = etree.XPath(
+    "(//table[contains(concat(' ', normalize-space(@class), ' '), ' risultati ')])[1]//tr"
+)
+_SSD_PAREN = re.compile(r"\(\w+\)")
+
+
+# Persistent (url templates, first_name, last_name) -> SSD memo shared across runs;
+# set SSD_CACHE_PATH to move it
+SSD_CACHE_PATH = os.environ.get("SSD_CACHE_PATH", "ssd_cache.db")
+
+_ssd_memo: dict[tuple[str, str, str], str] = {}
+_ssd_db: sqlite3.Connection | None = None
+_ssd_lock = threading.Lock()
+
+
+def _ssd_cache_db() -> sqlite3.Connection:
+    # Opened lazily; one connection guarded by _ssd_lock so fetch_ssd_many threads can share it
+    global _ssd_db
+    if _ssd_db is None:
+        _ssd_db = sqlite3.connect(SSD_CACHE_PATH, check_same_thread=False)
+        _ssd_db.execute("PRAGMA journal_mode=WAL")
+        # src = the two URL templates, so lookups against another source never share answers
+        _ssd_db.execute(
+            "CREATE TABLE IF NOT EXISTS ssd_src(src TEXT, fn TEXT, ln TEXT, val TEXT, PRIMARY KEY(src, fn, ln))"
+        )
+    return _ssd_db
+
+
+def _ssd_cache_get(src: str, first_name: str, last_name: str) -> str | None:
+    key = (src, first_name, last_name)
+    with _ssd_lock:
+        if key in _ssd_memo:
+            return _ssd_memo[key]
+        row = _ssd_cache_db().execute("SELECT val FROM ssd_src WHERE src=? AND fn=? AND ln=?", key).fetchone()
+        if row is not None:
+            _ssd_memo[key] = row[0]
+            return row[0]
+    return None
+
+
+def _ssd_cache_put(src: str, first_name: str, last_name: str, value: str) -> None:
+    with _ssd_lock:
+        _ssd_memo[(src, first_name, last_name)] = value
+        db = _ssd_cache_db()
+        db.execute(
+            "INSERT OR REPLACE INTO ssd_src(src, fn, ln, val) VALUES (?, ?, ?, ?)",
+            (src, first_name, last_name, value),
+        )
+        db.commit()
+
+
+def _cell_text(td) -> str:
+    # Same as BeautifulSoup's get_text(strip=True): strip every text node, join with ""
+    return "".join(t.strip() for t in td.itertext())
+
 
 def fetch_ssd(
     first_name: str,
@@ -21,37 +84,56 @@ def fetch_ssd(
     session: requests.Session | None = None,
     docenti_url_template: str = DOCENTI_URL_DEFAULT,
     assegnisti_url_template: str = ASSEGNASTI_URL_DEFAULT,
+    use_cache: bool = True,
 ) -> str:
     """
     Fetch SSD by querying first DOCENTI (by last_name), then ASSEGNASTI (by last_name + first_name).
+    With use_cache, answers are memoised in-process and in the SQLite file at SSD_CACHE_PATH,
+    keyed by the URL templates as well as the name; lookups where a request failed or a
+    page could not be parsed are not cached.
 
     Returns:
         - SSD string if found
         - "NULL" otherwise
     """
 
+    request_failed = False
+
     def _extract_ssd_from_url(url: str) -> str:
+        nonlocal request_failed
         try:
             s = session or requests
             resp = s.get(url, timeout=timeout)
             resp.raise_for_status()
         except requests.RequestException:
+            request_failed = True
             return "NULL"
 
-        soup = BeautifulSoup(resp.text, "html.parser")
-        table = soup.find("table", {"class": "risultati"})
-        if not table:
+        try:
+            # resp.text, not resp.content: the charset may only be in the HTTP headers
+            tree = lxml_html.fromstring(resp.text)
+        except ValueError:
+            # lxml refuses str input carrying an XML encoding declaration: parse the bytes,
+            # decoded with the same charset resp.text used
+            try:
+                parser = lxml_html.HTMLParser(encoding=resp.encoding) if resp.encoding else None
+                tree = lxml_html.fromstring(resp.content, parser=parser)
+            except (etree.ParserError, ValueError):
+                request_failed = True  # unparseable (e.g. empty) page: don't cache the NULL
+                return "NULL"
+        except etree.ParserError:
+            request_failed = True
             return "NULL"
 
-        rows = table.find_all("tr")[1:]  # skip header row
+        rows = _RESULT_ROWS(tree)[1:]  # skip header row
         for row in rows:
-            cols = row.find_all("td")
+            cols = row.xpath(".//td")
             if len(cols) >= 7:
-                ssd_2024 = cols[5].get_text(strip=True)
-                department = cols[6].get_text(strip=True)
+                ssd_2024 = _cell_text(cols[5])
+                department = _cell_text(cols[6])
 
                 # Your original logic: if SSD looks like a department name (some assegnisti), return department
-                if re.search(r"\(\w+\)", ssd_2024):
+                if _SSD_PAREN.search(ssd_2024):
                     return department
 
                 return ssd_2024
@@ -65,6 +147,12 @@ def fetch_ssd(
     if not last_name:
         return "NULL"
 
+    cache_src = docenti_url_template + "\0" + assegnisti_url_template
+    if use_cache:
+        cached = _ssd_cache_get(cache_src, first_name, last_name)
+        if cached is not None:
+            return cached
+
     # 1) DOCENTI lookup (only last name in your current URL design)
     ssd_value = _extract_ssd_from_url(docenti_url_template.format(last_name))
 
@@ -72,4 +160,35 @@ def fetch_ssd(
     if ssd_value == "NULL" and first_name:
         ssd_value = _extract_ssd_from_url(assegnisti_url_template.format(last_name, first_name))
 
-    return ssd_value
\ No newline at end of file
+    if use_cache and not request_failed:
+        _ssd_cache_put(cache_src, first_name, last_name, ssd_value)
+
+    return ssd_value
+
+
+def fetch_ssd_many(
+    pairs: list[tuple[str, str]],
+    *,
+    workers: int = 16,
+    timeout: int = 10,
+    session: requests.Session | None = None,
+) -> list[str]:
+    """
+    Run fetch_ssd for many (first_name, last_name) pairs concurrently.
+
+    Requests share one pooled Session (created here unless one is passed in).
+    Returns SSD strings in the same order as pairs.
+    """
+    own_session = session is None
+    if own_session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            return list(ex.map(lambda p: fetch_ssd(p[0], p[1], timeout=timeout, session=session), pairs))
+    finally:
+        if own_session:
+            session.close()
@@ -0,0 +1,103 @@
+"""
+Helpers shared by the OpenRouter scripts (extract_keywords, paper_classification,
+translate_keywords): request pacing, retry decisions and the on-disk answer cache.
+
+The scripts are run as `python src/<script>.py`, so src/ is on sys.path and they
+import this module directly.
+"""
+
+from __future__ import annotations
+
+import random
+import sqlite3
+import threading
+import time
+from typing import Optional, Sequence, Tuple
+
+
+class RateLimiter:
+    """
+    Token bucket shared by worker threads: one request start per interval_s on average.
+    Up to burst tokens build up while idle, so short bursts are not throttled.
+    """
+
+    def __init__(self, interval_s: float, burst: int = 1):
+        self.interval_s = interval_s
+        self.burst = max(1, burst)
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+
+    def wait(self) -> None:
+        # Sleeping under the lock is fine: the other waiters would be throttled anyway
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                if self.interval_s > 0:
+                    self._tokens = min(self.burst, self._tokens + (now - self._last) / self.interval_s)
+                else:
+                    self._tokens = self.burst
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                time.sleep((1 - self._tokens) * self.interval_s)
+
+
+def retry_delay(retry_after: Optional[str], fallback_s: float) -> float:
+    """Wait after a 429/503: the server's Retry-After seconds if given, else fallback_s; capped at 30s, plus jitter."""
+    try:
+        delay = float(retry_after) if retry_after else fallback_s
+    except ValueError:  # HTTP-date form; not worth parsing
+        delay = fallback_s
+    delay = min(max(delay, 0.0), 30.0)
+    return delay + random.uniform(0, 0.5 * delay)
+
+
+def is_client_error(e: Exception) -> bool:
+    """4xx other than 429: the same request will fail again, so it is not retried."""
+    resp = getattr(e, "response", None)
+    return resp is not None and 400 <= resp.status_code < 500 and resp.status_code != 429
+
+
+class SqliteCache:
+    """
+    Persistent key -> row memo in one SQLite table, shared across runs.
+    The connection is opened on first use (WAL mode) and shared by worker threads under a lock.
+    """
+
+    def __init__(self, path: str, table: str, key_col: str, value_cols: Sequence[str]):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        cols = ", ".join(value_cols)
+        self._create = f"CREATE TABLE IF NOT EXISTS {table} ({key_col} TEXT PRIMARY KEY, {cols})"
+        self._select = f"SELECT {cols} FROM {table} WHERE {key_col} = ?"
+        self._insert = (
+            f"INSERT OR REPLACE INTO {table} ({key_col}, {cols}) VALUES (?{', ?' * len(value_cols)})"
+        )
+
+    def _db(self) -> sqlite3.Connection:
+        # caller holds self._lock
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(self._create)
+        return self._conn
+
+    def get(self, key: str) -> Optional[Tuple]:
+        with self._lock:
+            row = self._db().execute(self._select, (key,)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def put(self, key: str, values: Sequence) -> None:
+        with self._lock:
+            db = self._db()
+            db.execute(self._insert, (key, *values))
+            db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -15,17 +15,30 @@ from __future__ import annotations
 
 import argparse
 import csv
+import functools
+import hashlib
+import itertools
 import json
 import os
 import random
 import re
+import threading
 import time
-from dataclasses import dataclass
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from typing import Dict, List, Optional, Tuple
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 
+from openrouter_utils import RateLimiter, SqliteCache, is_client_error, retry_delay
 
+
+# The system prompts are built from this list and memoised; keep it stable and in order.
+# Any edit changes the prompt bytes, which invalidates the provider's prompt cache and
+# every ClassifierCache entry (the key includes the prompt hash).
 CATEGORIES: List[Dict[str, str]] = [
     {
         "id": "C1",
@@ -72,6 +85,65 @@ CATEGORIES: List[Dict[str, str]] = [
 
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 
+_FENCED = re.compile(r"```(?:json)?\s*(\{.*?\})\s*```", re.DOTALL)
+_BLOB = re.compile(r"(\{.*\})", re.DOTALL)
+
+
+class ClassifierCache:
+    """
+    On-disk memo of predictions keyed by sha256(model, normalised title, system prompt hash).
+    Titles equal up to case/whitespace share an entry; changing the model or the
+    categories prompt starts a fresh key space. Only successful predictions are stored.
+    """
+
+    def __init__(self, path: str, model: str, system_prompt: str):
+        self._prefix = model + "\0"
+        self._prompt_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+        self._store = SqliteCache(path, "predictions", "key", ("cid", "conf", "rat"))
+
+    def _key(self, title: str) -> str:
+        norm = " ".join(title.lower().split())
+        return hashlib.sha256(f"{self._prefix}{norm}\0{self._prompt_hash}".encode("utf-8")).hexdigest()
+
+    def get(self, title: str) -> Optional[Tuple[str, float, str]]:
+        return self._store.get(self._key(title))
+
+    def put(self, title: str, pred: Tuple[str, float, str]) -> None:
+        self._store.put(self._key(title), pred)
+
+    def close(self) -> None:
+        self._store.close()
+
+
+class EmbeddingRouter:
+    """
+    Local shortcut: a title whose embedding is close enough (cosine > threshold) to one
+    category's label + description is classified without an API call.
+    Needs the optional sentence-transformers package, imported only when a router is built.
+    """
+
+    def __init__(self, model_name: str, threshold: float):
+        from sentence_transformers import SentenceTransformer
+
+        self.threshold = threshold
+        self._lock = threading.Lock()  # one encode at a time across worker threads
+        self._model = SentenceTransformer(model_name)
+        self._ids = [c["id"] for c in CATEGORIES]
+        self._cat_emb = self._model.encode(
+            [c["label"] + " " + c["description"] for c in CATEGORIES], normalize_embeddings=True
+        )
+
+    def route(self, titles: List[str]) -> List[Optional[Tuple[str, float, str]]]:
+        """Prediction per title, or None where the best match is below threshold."""
+        with self._lock:
+            emb = self._model.encode(titles, batch_size=64, normalize_embeddings=True)
+        sim = emb @ self._cat_emb.T
+        out: List[Optional[Tuple[str, float, str]]] = []
+        for i, j in enumerate(sim.argmax(axis=1)):
+            conf = float(sim[i, j])
+            out.append((self._ids[j], conf, f"similarità embedding {conf:.2f}") if conf > self.threshold else None)
+        return out
+
 
 @dataclass
 class ORConfig:
@@ -81,12 +153,38 @@ class ORConfig:
     max_retries: int = 6
     base_backoff_s: float = 1.5
     rate_limit_s: float = 0.2  # adjust if you hit rate limits
+    rate_burst: int = 8  # request starts allowed back-to-back after an idle spell
+    # Keep-alive connection pool shared by every request; auth/attribution headers are set once
+    session: requests.Session = field(default_factory=requests.Session, repr=False)
+    cache: Optional[ClassifierCache] = field(default=None, repr=False)
+    router: Optional[EmbeddingRouter] = field(default=None, repr=False)
+    limiter: RateLimiter = field(init=False, repr=False)
+    payload_base: dict = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.limiter = RateLimiter(self.rate_limit_s, self.rate_burst)
+        # Request fields that never change within a run
+        self.payload_base = {"model": self.model, "temperature": 0.0}
+        self.session.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=0))
+        self.session.headers.update({
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            # Optional but recommended by OpenRouter:
+            "HTTP-Referer": "http://localhost",
+            "X-Title": "paper-title-classifier",
+        })
 
 
-def build_system_prompt() -> str:
-    cats = "\n".join(
+@functools.lru_cache(maxsize=1)
+def format_categories() -> str:
+    return "\n".join(
         [f"- {c['id']}: {c['label']} | {c['description']}" for c in CATEGORIES]
     )
+
+
+@functools.lru_cache(maxsize=1)
+def build_system_prompt() -> str:
+    cats = format_categories()
     return (
         "Sei un classificatore di titoli di articoli scientifici. "
         "Devi assegnare OGNI titolo ad UNA SOLA categoria tra le 8 elencate. "
@@ -104,36 +202,110 @@ def build_system_prompt() -> str:
     )
 
 
+@functools.lru_cache(maxsize=1)
+def build_batch_system_prompt() -> str:
+    cats = format_categories()
+    return (
+        "Sei un classificatore di titoli di articoli scientifici. "
+        "Riceverai piu' titoli numerati: devi assegnare OGNI titolo ad UNA SOLA categoria tra le 8 elencate. "
+        "Rispondi ESCLUSIVAMENTE in JSON valido (senza testo extra). "
+        "Se un titolo è ambiguo, scegli la categoria più probabile basandoti sui segnali semantici.\n\n"
+        "Categorie:\n"
+        f"{cats}\n\n"
+        "Output JSON schema:\n"
+        "{\n"
+        '  "results": [\n'
+        '    {"id": 0, "category_id": "C1|C2|...|C8", "confidence": 0.0-1.0, "rationale": "max 20 parole"}\n'
+        "  ]\n"
+        "}\n"
+        "Nota: un elemento per ogni titolo; id è il numero intero del titolo (0, 1, 2, ...); "
+        "confidence deve essere un numero decimale tra 0 e 1."
+    )
+
+
+# Structured output: providers that honour json_schema can only return a known category_id
+# and an in-range confidence. validate_prediction still runs for providers that ignore it.
+_PREDICTION_PROPERTIES = {
+    "category_id": {"type": "string", "enum": [c["id"] for c in CATEGORIES]},
+    "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+    "rationale": {"type": "string"},
+}
+
+PREDICTION_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "classification",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": _PREDICTION_PROPERTIES,
+            "required": ["category_id", "confidence", "rationale"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+BATCH_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "batch_classification",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "results": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"id": {"type": "integer"}, **_PREDICTION_PROPERTIES},
+                        "required": ["id", "category_id", "confidence", "rationale"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["results"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
 def build_user_prompt(title: str) -> str:
     return f'Titolo: "{title}"\nClassifica questo titolo in UNA delle 8 categorie.'
 
 
+def build_batch_user_prompt(titles: List[str]) -> str:
+    lines = "\n".join(f'{i}: "{t}"' for i, t in enumerate(titles))
+    return f"Classifica i seguenti titoli, ciascuno in UNA delle 8 categorie.\n{lines}"
+
+
 def extract_json(text: str) -> Optional[dict]:
     """
     Models sometimes wrap JSON in markdown. Try to recover robustly.
+    Structured output normally returns a bare object, so the direct parse goes first;
+    orjson.loads already ignores surrounding whitespace. The fallbacks only run for
+    providers that don't honour response_format.
     """
-    text = text.strip()
-
     # direct parse
     try:
-        return json.loads(text)
+        return orjson.loads(text)
     except Exception:
         pass
 
     # fenced code block
-    m = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", text, flags=re.DOTALL)
+    m = _FENCED.search(text)
     if m:
         try:
-            return json.loads(m.group(1))
+            return orjson.loads(m.group(1))
         except Exception:
             pass
 
     # first {...} blob
-    m = re.search(r"(\{.*\})", text, flags=re.DOTALL)
+    m = _BLOB.search(text)
     if m:
         blob = m.group(1)
         try:
-            return json.loads(blob)
+            return orjson.loads(blob)
         except Exception:
             pass
 
@@ -164,50 +336,73 @@ def validate_prediction(obj: dict) -> Optional[Tuple[str, float, str]]:
     return cid, conf_f, rat
 
 
-def openrouter_classify_title(cfg: ORConfig, system_prompt: str, title: str) -> Tuple[str, float, str]:
-    headers = {
-        "Authorization": f"Bearer {cfg.api_key}",
-        "Content-Type": "application/json",
-        # Optional but recommended by OpenRouter:
-        "HTTP-Referer": "http://localhost",
-        "X-Title": "paper-title-classifier",
-    }
+def validate_batch(obj: dict, n: int) -> Optional[List[Optional[Tuple[str, float, str]]]]:
+    """Per-title predictions by position; None where an entry is missing or invalid."""
+    if not isinstance(obj, dict):
+        return None
+    results = obj.get("results")
+    if not isinstance(results, list):
+        return None
+
+    out: List[Optional[Tuple[str, float, str]]] = [None] * n
+    for entry in results:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            i = int(entry.get("id"))
+        except (TypeError, ValueError):
+            continue
+        if 0 <= i < n and out[i] is None:
+            out[i] = validate_prediction(entry)
 
-    payload = {
-        "model": cfg.model,
-        "temperature": 0.0,
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": build_user_prompt(title)},
-        ],
-        # Encourage strict JSON output:
-        "response_format": {"type": "json_object"},
+    if all(p is None for p in out):
+        return None
+    return out
+
+
+@functools.lru_cache(maxsize=4)
+def _system_message(system_prompt: str) -> dict:
+    # Built once per prompt and shared read-only by every request (and thread).
+    # Byte-identical system prompt on every call; cache_control lets providers that support
+    # prompt caching (e.g. Anthropic via OpenRouter) reuse it, others ignore the marker.
+    return {
+        "role": "system",
+        "content": [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}],
     }
 
+
+def _openrouter_json(cfg: ORConfig, system_prompt: str, user_prompt: str, validate, response_format: dict):
+    # Fresh top-level dict and messages list per call: the static parts are shared, so never mutate them
+    payload = dict(
+        cfg.payload_base,
+        messages=[_system_message(system_prompt), {"role": "user", "content": user_prompt}],
+        response_format=response_format,
+    )
+
     for attempt in range(cfg.max_retries):
         try:
-            r = requests.post(OPENROUTER_URL, headers=headers, json=payload, timeout=cfg.timeout_s)
-            if r.status_code == 429:
-                # rate limited
-                backoff = cfg.base_backoff_s * (2 ** attempt) + random.random()
-                time.sleep(backoff)
+            cfg.limiter.wait()
+            r = cfg.session.post(OPENROUTER_URL, data=orjson.dumps(payload), timeout=cfg.timeout_s)
+            if r.status_code in (429, 503) and attempt < cfg.max_retries - 1:
+                # rate limited / overloaded: wait as long as the server asks
+                time.sleep(retry_delay(r.headers.get("Retry-After"), cfg.base_backoff_s * (2 ** attempt)))
                 continue
             r.raise_for_status()
 
-            data = r.json()
+            data = orjson.loads(r.content)
             content = data["choices"][0]["message"]["content"]
             obj = extract_json(content)
             if obj is None:
                 raise ValueError(f"Could not parse JSON. Raw content: {content[:300]}")
 
-            pred = validate_prediction(obj)
+            pred = validate(obj)
             if pred is None:
                 raise ValueError(f"Invalid prediction JSON: {obj}")
 
             return pred
 
         except Exception as e:
-            if attempt == cfg.max_retries - 1:
+            if attempt == cfg.max_retries - 1 or is_client_error(e):
                 raise
             backoff = cfg.base_backoff_s * (2 ** attempt) + random.random()
             time.sleep(backoff)
@@ -215,35 +410,145 @@ def openrouter_classify_title(cfg: ORConfig, system_prompt: str, title: str) ->
     raise RuntimeError("Unexpected retry loop termination.")
 
 
-def read_input_rows(input_path: str) -> List[dict]:
-    with open(input_path, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        return list(reader)
+def openrouter_classify_title(cfg: ORConfig, system_prompt: str, title: str) -> Tuple[str, float, str]:
+    if cfg.cache is not None:
+        hit = cfg.cache.get(title)
+        if hit is not None:
+            return hit
+    if cfg.router is not None:
+        routed = cfg.router.route([title])[0]
+        if routed is not None:
+            return routed
+
+    pred = _openrouter_json(cfg, system_prompt, build_user_prompt(title), validate_prediction, PREDICTION_FORMAT)
+    if cfg.cache is not None:
+        cfg.cache.put(title, pred)
+    return pred
+
+
+def openrouter_classify_batch(cfg: ORConfig, system_prompt: str, titles: List[str]) -> List[Tuple[str, float, str]]:
+    """
+    Classify several titles in one request (system_prompt from build_batch_system_prompt).
+    Cached titles, and titles the embedding router is confident about, are answered
+    locally; titles the batch answer leaves out (or the whole batch, on failure) are
+    retried one at a time with the single-title prompt.
+    """
+    preds: List[Optional[Tuple[str, float, str]]] = [None] * len(titles)
+    if cfg.cache is not None:
+        preds = [cfg.cache.get(t) for t in titles]
+    if cfg.router is not None:
+        todo = [i for i, p in enumerate(preds) if p is None]
+        if todo:
+            for i, p in zip(todo, cfg.router.route([titles[i] for i in todo])):
+                preds[i] = p
+
+    misses = [i for i, p in enumerate(preds) if p is None]
+    if misses:
+        ask = [titles[i] for i in misses]
+        try:
+            answers = _openrouter_json(
+                cfg, system_prompt, build_batch_user_prompt(ask), lambda obj: validate_batch(obj, len(ask)),
+                BATCH_FORMAT,
+            )
+        except Exception:
+            answers = [None] * len(ask)
+        for i, p in zip(misses, answers):
+            if p is not None:
+                preds[i] = p
+                if cfg.cache is not None:
+                    cfg.cache.put(titles[i], p)
+
+    single_prompt = build_system_prompt()
+    return [
+        p if p is not None else openrouter_classify_title(cfg, single_prompt, t)
+        for t, p in zip(titles, preds)
+    ]
+
+
+def done_sidecar_path(output_path: str) -> str:
+    # A {"key_field": ...} header line, then one JSON-encoded key per line
+    # (JSON so keys containing newlines stay on one line)
+    return output_path + ".done"
 
 
 def load_done_keys(output_path: str, key_field: str) -> set:
     """
-    Read existing output and collect processed keys to make the script resumable.
+    Collect processed keys to make the script resumable.
+    Reads the .done sidecar when it belongs to the existing output and holds key_field;
+    otherwise scans only the key column of the output (if any) and rewrites the sidecar
+    from it, so CsvAppender can keep appending to it.
     """
+    sidecar = done_sidecar_path(output_path)
+    header = {"key_field": key_field}
+    # CsvAppender appends each key after its row, so a sidecar that matches the output is
+    # at least as new; an output that is missing or newer was deleted/replaced (or ended on
+    # a row without a key) and is re-scanned instead.
+    if (
+        os.path.exists(sidecar)
+        and os.path.exists(output_path)
+        and os.path.getmtime(sidecar) >= os.path.getmtime(output_path)
+    ):
+        with open(sidecar, encoding="utf-8") as f:
+            try:
+                same_field = json.loads(f.readline()) == header
+            except ValueError:
+                same_field = False
+            if same_field:
+                return {json.loads(line) for line in f if line.strip()}
+
     done = set()
-    if not os.path.exists(output_path):
-        return done
-    with open(output_path, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            k = (row.get(key_field) or "").strip()
-            if k:
-                done.add(k)
+    if os.path.exists(output_path):
+        with open(output_path, newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            if key_field in header:
+                key_idx = header.index(key_field)
+                for row in reader:
+                    k = row[key_idx].strip() if key_idx < len(row) else ""
+                    if k:
+                        done.add(k)
+
+    with open(sidecar, "w", encoding="utf-8") as f:
+        f.write(json.dumps(header) + "\n")
+        f.writelines(json.dumps(k) + "\n" for k in done)
     return done
 
 
-def append_row(output_path: str, fieldnames: List[str], row: dict) -> None:
-    file_exists = os.path.exists(output_path)
-    with open(output_path, "a", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        if not file_exists:
-            writer.writeheader()
-        writer.writerow(row)
+class CsvAppender:
+    """
+    Output CSV (and its .done sidecar, already started by load_done_keys) opened once for the whole run.
+    Each write is flushed, so an interrupted run keeps every finished row.
+    """
+
+    def __init__(self, output_path: str, fieldnames: List[str], fsync: bool = False):
+        new = not os.path.exists(output_path)
+        self.fsync = fsync
+        self.f = open(output_path, "a", newline="", encoding="utf-8", buffering=1 << 20)
+        self.done_f = open(done_sidecar_path(output_path), "a", encoding="utf-8")
+        self.w = csv.writer(self.f)
+        if new:
+            self.w.writerow(fieldnames)
+
+    def write(self, values: List[str], done_key: str = "") -> None:
+        """values must be in fieldnames order."""
+        self.w.writerow(values)
+        self.f.flush()
+        if self.fsync:
+            os.fsync(self.f.fileno())
+        if done_key:
+            # after the row, so a crash in between re-does the row rather than losing it
+            self.done_f.write(json.dumps(done_key) + "\n")
+            self.done_f.flush()
+
+    def close(self) -> None:
+        self.f.close()
+        self.done_f.close()
+
+    def __enter__(self) -> "CsvAppender":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
 
 
 def main():
@@ -253,75 +558,128 @@ def main():
     ap.add_argument("--title-col", default="title", help="Column name containing the paper title")
     ap.add_argument("--id-col", default=None, help="Optional unique ID column; if omitted, uses title as key")
     ap.add_argument("--model", default="openai/gpt-4o-mini", help="OpenRouter model name")
-    ap.add_argument("--rate-limit", type=float, default=0.2, help="Sleep seconds between requests")
+    ap.add_argument("--rate-limit", type=float, default=0.2, help="Average seconds between request starts")
+    ap.add_argument("--burst", type=int, default=8, help="Request starts allowed back-to-back before --rate-limit applies")
+    ap.add_argument("--workers", type=int, default=8, help="Concurrent requests in flight (connection pool holds 32)")
+    ap.add_argument("--batch-size", type=int, default=20, help="Titles sent per request (1 = one title per call)")
+    ap.add_argument("--cache", default="classify_cache.sqlite", help="SQLite prediction cache ('' disables it)")
+    ap.add_argument("--fsync", action="store_true", help="fsync the output after every row")
+    ap.add_argument(
+        "--embed-threshold", type=float, default=None,
+        help="Classify titles locally when their embedding similarity to a category exceeds this "
+             "(e.g. 0.55); off by default, needs sentence-transformers",
+    )
+    ap.add_argument(
+        "--embed-model", default="paraphrase-multilingual-MiniLM-L12-v2",
+        help="sentence-transformers model for --embed-threshold",
+    )
     args = ap.parse_args()
 
     api_key = os.environ.get("OPENROUTER_API_KEY", "").strip()
     if not api_key:
         raise SystemExit("Missing OPENROUTER_API_KEY env var.")
 
-    cfg = ORConfig(api_key=api_key, model=args.model, rate_limit_s=args.rate_limit)
-    system_prompt = build_system_prompt()
-
-    rows = read_input_rows(args.input)
-    if not rows:
-        raise SystemExit("Input CSV is empty.")
+    cache = ClassifierCache(args.cache, args.model, build_system_prompt()) if args.cache else None
+    router = EmbeddingRouter(args.embed_model, args.embed_threshold) if args.embed_threshold is not None else None
+    cfg = ORConfig(
+        api_key=api_key, model=args.model, rate_limit_s=args.rate_limit, rate_burst=args.burst,
+        cache=cache, router=router,
+    )
+    batch_size = max(1, args.batch_size)
+    system_prompt = build_batch_system_prompt() if batch_size > 1 else build_system_prompt()
 
     key_field = args.id_col or args.title_col
     done = load_done_keys(args.output, key_field=key_field)
-
-    out_fields = list(rows[0].keys()) + [
-        "pred_category_id",
-        "pred_category_label",
-        "pred_confidence",
-        "pred_rationale",
-    ]
-
     id_to_label = {c["id"]: c["label"] for c in CATEGORIES}
+    workers = max(1, args.workers)
 
     processed = 0
     skipped = 0
 
-    for i, row in enumerate(rows, start=1):
-        key = (row.get(key_field) or "").strip()
-        title = (row.get(args.title_col) or "").strip()
-
-        if not title:
-            # still write a row to keep alignment
-            row_out = dict(row)
-            row_out.update({
-                "pred_category_id": "",
-                "pred_category_label": "",
-                "pred_confidence": "",
-                "pred_rationale": "Missing title",
-            })
-            append_row(args.output, out_fields, row_out)
-            continue
-
-        if key and key in done:
-            skipped += 1
-            continue
-
-        cid, conf, rat = openrouter_classify_title(cfg, system_prompt, title)
-        row_out = dict(row)
-        row_out.update({
-            "pred_category_id": cid,
-            "pred_category_label": id_to_label.get(cid, ""),
-            "pred_confidence": f"{conf:.3f}",
-            "pred_rationale": rat,
-        })
-        append_row(args.output, out_fields, row_out)
-
-        if key:
-            done.add(key)
-        processed += 1
-
-        # basic pacing
-        time.sleep(cfg.rate_limit_s)
-
-        if i % 50 == 0:
-            print(f"Progress: {i}/{len(rows)} rows | processed={processed} | skipped={skipped}")
+    # The input is streamed: batches are submitted as they fill up, with at most
+    # 2 * workers batches queued, so memory stays flat however large the CSV is.
+    with open(args.input, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        first = next(reader, None)
+        if first is None:
+            raise SystemExit("Input CSV is empty.")
+
+        in_fields = list(reader.fieldnames)
+        out_fields = in_fields + [
+            "pred_category_id",
+            "pred_category_label",
+            "pred_confidence",
+            "pred_rationale",
+        ]
+
+        with CsvAppender(args.output, out_fields, fsync=args.fsync) as out, \
+                ThreadPoolExecutor(max_workers=workers) as ex:
+            # (future, batch) in input order; a batch may carry "Missing title" rows that are not sent
+            pending: deque = deque()
+
+            def submit(batch: List[Tuple[dict, str, str]]) -> None:
+                titles = [title for _, title, _ in batch if title]
+                if not titles:
+                    fut = None
+                elif batch_size > 1:
+                    fut = ex.submit(openrouter_classify_batch, cfg, system_prompt, titles)
+                else:
+                    fut = ex.submit(lambda t: [openrouter_classify_title(cfg, system_prompt, t)], titles[0])
+                pending.append((fut, batch))
+
+            # Requests run on worker threads; rows are written from this thread only, in input order:
+            # finished batches are taken from the head, blocking on it while more than max_pending are queued.
+            def write_ready(max_pending: int) -> None:
+                nonlocal processed
+                while pending and (len(pending) > max_pending or pending[0][0] is None or pending[0][0].done()):
+                    fut, batch = pending.popleft()
+                    preds = iter(fut.result() if fut is not None else ())
+                    before = processed
+                    for row, title, key in batch:
+                        values = [row.get(k, "") for k in in_fields]
+                        if not title:
+                            # still write a row to keep alignment
+                            out.write(values + ["", "", "", "Missing title"])
+                            continue
+                        cid, conf, rat = next(preds)
+                        out.write(values + [cid, id_to_label.get(cid, ""), f"{conf:.3f}", rat], done_key=key)
+                        processed += 1
+
+                    if processed // 50 > before // 50:
+                        print(f"Progress: processed={processed} | skipped={skipped}")
+
+            try:
+                batch: List[Tuple[dict, str, str]] = []
+                n_titles = 0
+                for row in itertools.chain([first], reader):
+                    key = (row.get(key_field) or "").strip()
+                    title = (row.get(args.title_col) or "").strip()
+
+                    if title:
+                        if key and key in done:
+                            skipped += 1
+                            continue
+                        if key:
+                            done.add(key)
+                        n_titles += 1
+                    batch.append((row, title, key))
+
+                    # the second bound keeps a run of missing titles from growing one batch forever
+                    if n_titles == batch_size or len(batch) >= 2 * batch_size:
+                        submit(batch)
+                        batch = []
+                        n_titles = 0
+                        write_ready(2 * workers)
+
+                if batch:
+                    submit(batch)
+                write_ready(0)
+            except BaseException:
+                ex.shutdown(wait=True, cancel_futures=True)
+                raise
 
+    if cache is not None:
+        cache.close()
     print(f"Done. processed={processed}, skipped={skipped}. Output: {args.output}")
 
 
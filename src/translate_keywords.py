@@ -9,7 +9,7 @@ Output:
 - keywords_en (English keywords; unchanged if already English)
 
 Requirements:
-pip install pandas langdetect requests
+pip install pandas langdetect requests orjson
 Set env var:
 export OPENROUTER_API_KEY="YOUR_KEY"
 """
@@ -17,14 +17,20 @@ export OPENROUTER_API_KEY="YOUR_KEY"
 from __future__ import annotations
 
 import os
-import json
+import re
+import random
 import time
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, TypeVar
 
+import orjson
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 from langdetect import detect, LangDetectException
 
+from openrouter_utils import SqliteCache, is_client_error, retry_delay
+
 
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY", "").strip()
 if not OPENROUTER_API_KEY:
@@ -32,6 +38,8 @@ if not OPENROUTER_API_KEY:
 
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 
+T = TypeVar("T")
+
 # Choose any model you have access to on OpenRouter.
 # This is a sensible default for light translation tasks.
 MODEL = "openai/gpt-4o-mini"
@@ -40,12 +48,38 @@ MODEL = "openai/gpt-4o-mini"
 APP_URL = os.environ.get("OPENROUTER_APP_URL", "https://localhost")
 APP_NAME = os.environ.get("OPENROUTER_APP_NAME", "keywords-translator")
 
+# One keep-alive session for every call, so only the first request pays the TLS handshake
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=0))
+_SESSION.headers.update({
+    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+    "Content-Type": "application/json",
+    "HTTP-Referer": APP_URL,  # optional but recommended by OpenRouter
+    "X-Title": APP_NAME,      # optional but recommended by OpenRouter
+})
+
+
+# Italian function words and word-final grave accents (città, è, perché) are a safe fast-pass
+_IT_MARKERS = re.compile(
+    r"\b(?:di|del|della|delle|degli|dei|nel|nella|nelle|alla|alle|sulla|dalla|gli)\b|[àèìòù]\b",
+    re.IGNORECASE,
+)
+
+# English function words; "in" is left out because it is just as common in Italian
+_EN_FUNCTION_WORDS = re.compile(r"\b(?:and|of|the|for|with)\b", re.IGNORECASE)
+
 
 def looks_italian(text: str) -> bool:
     """Return True if the string is detected as Italian; False otherwise."""
     t = (text or "").strip()
     if not t:
         return False
+    if _IT_MARKERS.search(t):
+        return True
+    # No Italian markers, plain ASCII and English function words: English, skip langdetect
+    if t.isascii() and _EN_FUNCTION_WORDS.search(t):
+        return False
+    # Ambiguous: fall back to langdetect (slow, pure Python)
     try:
         return detect(t) == "it"
     except LangDetectException:
@@ -53,6 +87,71 @@ def looks_italian(text: str) -> bool:
         return False
 
 
+# Persistent Italian -> English memo shared across runs; set TRANSLATION_CACHE_PATH to move it
+TRANSLATION_CACHE_PATH = os.environ.get("TRANSLATION_CACHE_PATH", "translations.sqlite")
+
+_CACHE = SqliteCache(TRANSLATION_CACHE_PATH, "translations", "it", ("en",))
+
+
+def _cache_key(keywords: str) -> str:
+    return " ".join(keywords.lower().split())
+
+
+def _cache_get(keywords: str) -> Optional[str]:
+    row = _CACHE.get(_cache_key(keywords))
+    return row[0] if row else None
+
+
+def _cache_put(keywords: str, en: str) -> None:
+    _CACHE.put(_cache_key(keywords), (en,))
+
+
+SYSTEM_PROMPT = "You are a precise translation assistant."
+BATCH_SIZE = 20  # keyword strings per batched request
+WORKERS = 8      # concurrent batched requests (the session pool holds 32 connections)
+
+
+def _chat(
+    payload: dict,
+    parse: Callable[[str], T],
+    timeout_s: int,
+    max_retries: int,
+    sleep_between_retries_s: float,
+) -> T:
+    """POST a chat completion and run parse() on the reply; a ValueError from parse is retried."""
+    last_err: Optional[Exception] = None
+
+    for attempt in range(1, max_retries + 1):
+        try:
+            r = _SESSION.post(OPENROUTER_URL, data=orjson.dumps(payload), timeout=timeout_s)
+            if r.status_code in (429, 503) and attempt < max_retries:
+                # rate limited / overloaded: wait as long as the server asks
+                time.sleep(retry_delay(r.headers.get("Retry-After"), sleep_between_retries_s * 2 ** (attempt - 1)))
+                continue
+            r.raise_for_status()
+            data = orjson.loads(r.content)
+            return parse(data["choices"][0]["message"]["content"])
+
+        except Exception as e:
+            last_err = e
+            if attempt < max_retries and not is_client_error(e):
+                # Jittered exponential backoff so parallel workers don't retry in lockstep
+                time.sleep(sleep_between_retries_s * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            else:
+                raise RuntimeError(f"OpenRouter call failed after {attempt} attempts: {e}") from e
+
+    # Unreachable, but keeps type checkers happy.
+    raise RuntimeError(f"OpenRouter call failed: {last_err}")
+
+
+def _clean_translation(out: str) -> str:
+    out = out.strip()
+    # Minimal cleanup: remove wrapping quotes if model adds them.
+    if len(out) >= 2 and ((out[0] == '"' and out[-1] == '"') or (out[0] == "'" and out[-1] == "'")):
+        out = out[1:-1].strip()
+    return out
+
+
 def openrouter_translate_keywords_it_to_en(
     keywords: str,
     model: str = MODEL,
@@ -63,7 +162,12 @@ def openrouter_translate_keywords_it_to_en(
     """
     Translate a comma-separated keyword string from Italian to English.
     Preserves comma-separated format, returns ONLY the translated keywords string.
+    Answers are cached in TRANSLATION_CACHE_PATH, keyed by the lowercased, whitespace-normalised input.
     """
+    cached = _cache_get(keywords)
+    if cached is not None:
+        return cached
+
     prompt = (
         "Translate the following comma-separated keywords from Italian to English.\n"
         "Rules:\n"
@@ -74,64 +178,110 @@ def openrouter_translate_keywords_it_to_en(
         f"Keywords: {keywords}"
     )
 
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": APP_URL,  # optional but recommended by OpenRouter
-        "X-Title": APP_NAME,      # optional but recommended by OpenRouter
-    }
-
     payload = {
         "model": model,
         "messages": [
-            {"role": "system", "content": "You are a precise translation assistant."},
+            {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": prompt},
         ],
         "temperature": 0.0,
     }
+    out = _chat(payload, _clean_translation, timeout_s, max_retries, sleep_between_retries_s)
+    _cache_put(keywords, out)
+    return out
 
-    last_err: Optional[Exception] = None
 
-    for attempt in range(1, max_retries + 1):
-        try:
-            r = requests.post(OPENROUTER_URL, headers=headers, data=json.dumps(payload), timeout=timeout_s)
-            r.raise_for_status()
-            data = r.json()
-            out = data["choices"][0]["message"]["content"].strip()
+def openrouter_translate_keywords_batch(
+    items: List[str],
+    model: str = MODEL,
+    timeout_s: int = 60,
+    max_retries: int = 3,
+    sleep_between_retries_s: float = 1.5,
+) -> Dict[str, str]:
+    """
+    Translate several comma-separated keyword strings in one request.
+    Returns {italian: english}; strings the batch answer leaves out (or all of them,
+    if the batch fails) are translated one at a time. Cached strings are not sent.
+    """
+    result: Dict[str, str] = {}
+    for k in items:
+        cached = _cache_get(k)
+        if cached is not None:
+            result[k] = cached
+    items = [k for k in items if k not in result]
+    if not items:
+        return result
+
+    lines = "\n".join(f"{i}: {k}" for i, k in enumerate(items))
+    prompt = (
+        "Translate each numbered line of comma-separated keywords from Italian to English.\n"
+        "Rules:\n"
+        "- Keep them comma-separated.\n"
+        "- Do not add or remove keywords.\n"
+        "- Keep proper nouns as-is.\n"
+        '- Return ONLY JSON: {"translations": [{"i": <line number>, "en": "<translated keywords>"}, ...]}\n\n'
+        f"{lines}"
+    )
 
-            # Minimal cleanup: remove wrapping quotes if model adds them.
-            if len(out) >= 2 and ((out[0] == '"' and out[-1] == '"') or (out[0] == "'" and out[-1] == "'")):
-                out = out[1:-1].strip()
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ],
+        "temperature": 0.0,
+        "response_format": {"type": "json_object"},
+    }
 
-            return out
+    def _parse(content: str) -> Dict[int, str]:
+        entries = orjson.loads(content).get("translations")
+        if not isinstance(entries, list):
+            raise ValueError(f"No translations list in: {content[:300]}")
+        out: Dict[int, str] = {}
+        for e in entries:
+            if isinstance(e, dict) and isinstance(e.get("i"), int) and isinstance(e.get("en"), str):
+                en = _clean_translation(e["en"])
+                if 0 <= e["i"] < len(items) and en:
+                    out.setdefault(e["i"], en)
+        return out
 
-        except Exception as e:
-            last_err = e
-            if attempt < max_retries:
-                time.sleep(sleep_between_retries_s)
-            else:
-                raise RuntimeError(f"OpenRouter call failed after {max_retries} attempts: {e}") from e
+    try:
+        by_index = _chat(payload, _parse, timeout_s, max_retries, sleep_between_retries_s)
+    except RuntimeError:
+        by_index = {}
 
-    # Unreachable, but keeps type checkers happy.
-    raise RuntimeError(f"OpenRouter call failed: {last_err}")
+    for i, k in enumerate(items):
+        if i in by_index:
+            result[k] = by_index[i]
+            _cache_put(k, by_index[i])
+        else:
+            result[k] = openrouter_translate_keywords_it_to_en(
+                k, model, timeout_s, max_retries, sleep_between_retries_s
+            )
+    return result
 
 
-def translate_keywords_column(df: pd.DataFrame) -> pd.DataFrame:
+def translate_keywords_column(df: pd.DataFrame, workers: int = WORKERS) -> pd.DataFrame:
     """
     Adds keywords_en:
     - If keywords detected as Italian -> translated via OpenRouter
     - Else -> copied as-is
+    Each distinct keyword string is detected and translated only once;
+    batches are sent concurrently over the shared session.
     """
-    def _process(k: str) -> str:
-        k = (k or "").strip()
-        if not k:
-            return k
-        if looks_italian(k):
-            return openrouter_translate_keywords_it_to_en(k)
-        return k
+    keywords = df["keywords"].fillna("").astype(str).str.strip()
+    uniq = keywords.unique()
+
+    italian = [k for k in uniq if k and looks_italian(k)]
+    batches = [italian[start:start + BATCH_SIZE] for start in range(0, len(italian), BATCH_SIZE)]
+    translations: Dict[str, str] = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        for result in ex.map(openrouter_translate_keywords_batch, batches):
+            translations.update(result)
 
+    mapping = {k: translations.get(k, k) for k in uniq}
     df = df.copy()
-    df["keywords_en"] = df["keywords"].apply(_process)
+    df["keywords_en"] = keywords.map(mapping)
     return df
 
 